@@ -48,7 +48,8 @@ interface Session {
   title: string
   preview: string
   created_at: string
-  conversation: string[]
+  status: string
+  summary_generated: boolean | null
 }
 
 function AppSidebar() {
@@ -115,6 +116,8 @@ export default function SessionsPage() {
   const [selectedSessions, setSelectedSessions] = useState<Set<string>>(new Set())
   const [isSelectionMode, setIsSelectionMode] = useState(false)
   const [batchDeleting, setBatchDeleting] = useState(false)
+  const [nextCursor, setNextCursor] = useState<string | null>(null)
+  const [loadingMore, setLoadingMore] = useState(false)
 
   const BACKEND_URL = "http://localhost:8000"
 
@@ -130,6 +133,7 @@ export default function SessionsPage() {
       if (response.ok) {
         const data = await response.json()
         setSessions(data.sessions || [])
+        setNextCursor(data.next_cursor || null)
         console.log('Fetched sessions:', data.sessions)
       } else {
         console.error('Failed to fetch sessions:', response.status, response.statusText)
@@ -143,6 +147,25 @@ export default function SessionsPage() {
     }
   }
 
+  const loadMoreSessions = async () => {
+    if (!nextCursor) return
+    try {
+      setLoadingMore(true)
+      const response = await fetch(`${BACKEND_URL}/sessions?cursor=${encodeURIComponent(nextCursor)}`)
+      if (!response.ok) {
+        throw new Error(`Failed to fetch sessions (${response.status})`)
+      }
+      const data = await response.json()
+      setSessions(prev => [...prev, ...(data.sessions || [])])
+      setNextCursor(data.next_cursor || null)
+    } catch (error) {
+      console.error('Error loading more sessions:', error)
+      setError('Failed to load more sessions. Please try again.')
+    } finally {
+      setLoadingMore(false)
+    }
+  }
+
   const handleSessionClick = (sessionId: string) => {
     if (isSelectionMode) {
       toggleSessionSelection(sessionId)
@@ -375,7 +398,8 @@ export default function SessionsPage() {
                         </Link>
                       </div>
                     ) : (
-                      sessions.map((session) => (
+                      <>
+                      {sessions.map((session) => (
                         <div
                           key={session.session_id}
                           onClick={() => handleSessionClick(session.session_id)}
@@ -438,7 +462,19 @@ export default function SessionsPage() {
                             </div>
                           </div>
                         </div>
-                      ))
+                      ))}
+                      {nextCursor && (
+                        <div className="flex justify-center pt-2">
+                          <button
+                            onClick={loadMoreSessions}
+                            disabled={loadingMore}
+                            className="px-6 py-2 text-sm font-medium text-purple-700 bg-white/70 border border-violet-200 rounded-lg hover:bg-white transition-all duration-300 disabled:opacity-50 disabled:cursor-not-allowed"
+                          >
+                            {loadingMore ? 'Loading...' : 'Load more sessions'}
+                          </button>
+                        </div>
+                      )}
+                      </>
                     )}
                   </div>
                 )}
@@ -219,6 +219,23 @@ export default function SettingsPage() {
     }
   }
 
+  // /sessions is paginated, follow next_cursor until every page has been read
+  const fetchAllSessions = async () => {
+    const sessions: any[] = []
+    let cursor: string | null = null
+    do {
+      const query: string = cursor ? `?limit=200&cursor=${encodeURIComponent(cursor)}` : "?limit=200"
+      const response = await fetch(`${BACKEND_URL}/sessions${query}`)
+      if (!response.ok) {
+        throw new Error(`Failed to fetch sessions: ${response.status}`)
+      }
+      const data = await response.json()
+      sessions.push(...(data.sessions || []))
+      cursor = data.next_cursor || null
+    } while (cursor)
+    return sessions
+  }
+
   const handleResetChatHistory = async () => {
     if (!window.confirm("Are you sure you want to reset your chat history? This action cannot be undone and will delete ALL your sessions.")) {
       return
@@ -227,13 +244,7 @@ export default function SettingsPage() {
     setIsLoading(true)
     try {
       // First get all sessions
-      const response = await fetch(`${BACKEND_URL}/sessions`)
-      if (!response.ok) {
-        throw new Error(`Failed to fetch sessions: ${response.status}`)
-      }
-
-      const data = await response.json()
-      const sessions = data.sessions || []
+      const sessions = await fetchAllSessions()
 
       if (sessions.length === 0) {
         alert("No chat history found to reset.")
@@ -282,21 +293,16 @@ export default function SettingsPage() {
     setIsLoading(true)
     try {
       // First delete all sessions
-      const sessionsResponse = await fetch(`${BACKEND_URL}/sessions`)
-      if (sessionsResponse.ok) {
-        const data = await sessionsResponse.json()
-        const sessions = data.sessions || []
-        
-        if (sessions.length > 0) {
-          const sessionIds = sessions.map((session: any) => session.session_id)
-          await fetch(`${BACKEND_URL}/sessions/batch`, {
-            method: 'DELETE',
-            headers: {
-              'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({ session_ids: sessionIds })
-          })
-        }
+      const sessions = await fetchAllSessions().catch(() => [])
+      if (sessions.length > 0) {
+        const sessionIds = sessions.map((session: any) => session.session_id)
+        await fetch(`${BACKEND_URL}/sessions/batch`, {
+          method: 'DELETE',
+          headers: {
+            'Content-Type': 'application/json'
+          },
+          body: JSON.stringify({ session_ids: sessionIds })
+        })
       }
 
       // Delete the user account from the backend
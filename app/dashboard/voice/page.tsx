@@ -111,6 +111,8 @@ export default function VoiceModePage() {
   const mediaRecorderRef = useRef<MediaRecorder | null>(null)
   const audioChunksRef = useRef<Blob[]>([])
   const audioRef = useRef<HTMLAudioElement | null>(null)
+  // Seq of the last history message we have, so each refresh only fetches newer ones
+  const historyCursorRef = useRef(-1)
 
   const BACKEND_URL = "http://localhost:8000"
 
@@ -183,6 +185,8 @@ export default function VoiceModePage() {
         
         if (data && data.session_id) {
           setSessionId(data.session_id);
+          historyCursorRef.current = -1;
+          setConversationHistory([]);
           console.log('Session started:', data.session_id);
         } else {
           console.error('Missing session_id in response:', data);
@@ -317,10 +321,13 @@ export default function VoiceModePage() {
     if (!sessionId) return
 
     try {
-      const response = await fetch(`${BACKEND_URL}/conversation-history/${sessionId}`)
+      const since = historyCursorRef.current
+      const response = await fetch(`${BACKEND_URL}/conversation-history/${sessionId}?since=${since}`)
       if (response.ok) {
         const data = await response.json()
-        setConversationHistory(data.history || [])
+        const newMessages: string[] = data.conversation || []
+        setConversationHistory(prev => (since < 0 ? newMessages : [...prev, ...newMessages]))
+        historyCursorRef.current = data.cursor ?? since
       }
     } catch (error) {
       console.error('Error fetching conversation history:', error)
@@ -0,0 +1,206 @@
+"""
+Backfill summaries for ended sessions that don't have one yet.
+
+Pages through eligible sessions in id order, summarizes them with bounded
+concurrency through the same Gemini scheduler the API uses, and checkpoints
+progress after every page so an interrupted run can be resumed.
+
+Usage (from the backend directory):
+    python backfill_summaries.py --concurrency 4 --requests-per-minute 30
+    python backfill_summaries.py --reset    # start again from the first session
+    python backfill_summaries.py --retry-failed    # retry failed sessions, then continue
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from app import (
+    LLMRequestDropped,
+    TokenBucket,
+    db_executor,
+    get_or_generate_summary,
+    llm_scheduler,
+    load_conversation,
+    logger,
+    run_query,
+    save_session_summary,
+    supabase,
+)
+
+ELIGIBLE_COLUMNS = "id, session_id, summary, struggles, observations, tips, summary_generated, summary_hash, summary_upto_seq"
+
+
+def load_checkpoint(path: str) -> dict:
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {"last_id": 0, "succeeded": 0, "skipped": 0, "failed": 0, "failed_session_ids": []}
+
+
+def save_checkpoint(path: str, checkpoint: dict):
+    # Write to a temp file first so a crash never leaves a half-written checkpoint
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(temp_path, path)
+
+
+async def fetch_eligible_page(after_id: int, page_size: int) -> list:
+    res = await run_query(
+        supabase.table("sessions").select(ELIGIBLE_COLUMNS)
+        .eq("status", "ended")
+        .or_("summary_generated.is.null,summary_generated.eq.false")
+        .gt("id", after_id)
+        .order("id")
+        .limit(page_size)
+    )
+    return res.data or []
+
+
+async def fetch_sessions_by_id(session_ids: list) -> list:
+    res = await run_query(
+        supabase.table("sessions").select(ELIGIBLE_COLUMNS + ", status").in_("session_id", session_ids)
+    )
+    return res.data or []
+
+
+async def backfill_session(session_row: dict) -> str:
+    """Summarize one session. Returns 'succeeded', 'skipped' or 'failed'."""
+    session_id = session_row["session_id"]
+    try:
+        # Raises on a database error, so the session is recorded as failed instead of skipped
+        conversation = await load_conversation(session_id)
+        if len(conversation) < 2:
+            return "skipped"
+
+        summary, summary_hash, cached = await get_or_generate_summary(session_id, conversation, session_row)
+        if summary_hash is None:
+            # Don't store fallback summaries from a backfill, leave the session for a later run
+            logger.warning(f"No usable summary for session {session_id}")
+            return "failed"
+
+        await save_session_summary(session_id, summary, summary_hash)
+        return "succeeded"
+    except LLMRequestDropped:
+        logger.warning(f"Summary request for session {session_id} dropped by LLM scheduler")
+        return "failed"
+    except Exception as e:
+        logger.error(f"Failed to backfill summary for session {session_id}: {e}")
+        return "failed"
+
+
+def resolve_failed(checkpoint: dict, session_id: str, outcome: str):
+    """Move a previously failed session over to its new outcome"""
+    checkpoint["failed_session_ids"].remove(session_id)
+    checkpoint["failed"] -= 1
+    checkpoint[outcome] += 1
+
+
+async def retry_failed_sessions(args, checkpoint: dict, bounded):
+    """Run the sessions recorded as failed again, dropping each one that no longer fails"""
+    # Older checkpoints could list a session more than once
+    failed_ids = list(dict.fromkeys(checkpoint["failed_session_ids"]))
+    checkpoint["failed_session_ids"] = list(failed_ids)
+    checkpoint["failed"] = len(failed_ids)
+    logger.info(f"Retrying {len(failed_ids)} previously failed sessions")
+    for start in range(0, len(failed_ids), args.page_size):
+        page_ids = failed_ids[start:start + args.page_size]
+        rows = {row["session_id"]: row for row in await fetch_sessions_by_id(page_ids)}
+        retry_rows = []
+        for session_id in page_ids:
+            row = rows.get(session_id)
+            if row is None or row.get("status") != "ended" or row.get("summary_generated"):
+                # Deleted, reopened or summarized since, nothing left to retry
+                resolve_failed(checkpoint, session_id, "skipped")
+            else:
+                retry_rows.append(row)
+
+        for session_row, outcome in await asyncio.gather(*(bounded(row) for row in retry_rows)):
+            if outcome == "failed":
+                continue
+            resolve_failed(checkpoint, session_row["session_id"], outcome)
+        save_checkpoint(args.checkpoint, checkpoint)
+
+    logger.info(f"Retry pass finished, {len(checkpoint['failed_session_ids'])} sessions still failing")
+
+
+async def run_backfill(args):
+    if args.requests_per_minute:
+        llm_scheduler.request_bucket = TokenBucket(args.requests_per_minute)
+    if args.tokens_per_minute:
+        llm_scheduler.token_bucket = TokenBucket(args.tokens_per_minute)
+
+    if args.reset and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    checkpoint = load_checkpoint(args.checkpoint)
+    logger.info(f"Starting summary backfill after session id {checkpoint['last_id']}")
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    started_at = time.monotonic()
+    processed_this_run = 0
+
+    async def bounded(session_row: dict):
+        async with semaphore:
+            return session_row, await backfill_session(session_row)
+
+    if args.retry_failed and checkpoint["failed_session_ids"]:
+        await retry_failed_sessions(args, checkpoint, bounded)
+
+    while args.limit is None or processed_this_run < args.limit:
+        page_size = args.page_size
+        if args.limit is not None:
+            page_size = min(page_size, args.limit - processed_this_run)
+        page = await fetch_eligible_page(checkpoint["last_id"], page_size)
+        if not page:
+            break
+
+        for session_row, outcome in await asyncio.gather(*(bounded(row) for row in page)):
+            checkpoint[outcome] += 1
+            if outcome == "failed" and session_row["session_id"] not in checkpoint["failed_session_ids"]:
+                checkpoint["failed_session_ids"].append(session_row["session_id"])
+
+        # Only advance past a page once every session in it has been handled
+        checkpoint["last_id"] = page[-1]["id"]
+        save_checkpoint(args.checkpoint, checkpoint)
+
+        processed_this_run += len(page)
+        elapsed = time.monotonic() - started_at
+        rate = processed_this_run / elapsed * 60 if elapsed > 0 else 0.0
+        logger.info(
+            f"Backfill progress: {processed_this_run} sessions this run ({rate:.1f}/min) - "
+            f"succeeded={checkpoint['succeeded']} skipped={checkpoint['skipped']} "
+            f"failed={checkpoint['failed']} last_id={checkpoint['last_id']}"
+        )
+
+    elapsed = time.monotonic() - started_at
+    logger.info(
+        f"Backfill finished: {processed_this_run} sessions in {elapsed:.1f}s "
+        f"({processed_this_run / elapsed * 60 if elapsed > 0 else 0.0:.1f}/min)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate summaries for ended sessions without one")
+    parser.add_argument("--concurrency", type=int, default=4, help="Sessions summarized at the same time")
+    parser.add_argument("--page-size", type=int, default=100, help="Sessions fetched per page")
+    parser.add_argument("--limit", type=int, default=None, help="Stop after this many sessions")
+    parser.add_argument("--checkpoint", default="backfill_checkpoint.json", help="Checkpoint file path")
+    parser.add_argument("--reset", action="store_true", help="Ignore an existing checkpoint")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="Retry the checkpoint's failed sessions before continuing the scan")
+    parser.add_argument("--requests-per-minute", type=int, default=None,
+                        help="Gemini request budget for this run (defaults to GEMINI_REQUESTS_PER_MINUTE)")
+    parser.add_argument("--tokens-per-minute", type=int, default=None,
+                        help="Gemini token budget for this run (defaults to GEMINI_TOKENS_PER_MINUTE)")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(run_backfill(args))
+    finally:
+        db_executor.shutdown(wait=True)
+
+
+if __name__ == "__main__":
+    main()
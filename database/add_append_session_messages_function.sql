@@ -0,0 +1,55 @@
+-- Append conversation messages with database-checked sequence numbers
+-- Run this in your Supabase SQL editor
+-- The backend proposes seq values from its session cache. Appends are serialized
+-- per session by locking the sessions row; a row whose seq is already taken by
+-- the same content is a replayed write and is skipped, any other conflict moves
+-- the row (and the rest of that session's rows in the call) to MAX(seq) + 1.
+-- Returns the rows that were moved so the caller can resync its cache.
+
+CREATE OR REPLACE FUNCTION append_session_messages(p_rows JSONB)
+RETURNS JSONB AS $$
+DECLARE
+    r JSONB;
+    v_session_id VARCHAR(255);
+    v_seq INTEGER;
+    v_existing TEXT;
+    v_relocated TEXT[] := '{}';
+    v_moved JSONB := '[]'::JSONB;
+BEGIN
+    FOR r IN SELECT value FROM jsonb_array_elements(p_rows) LOOP
+        v_session_id := r->>'session_id';
+        v_seq := (r->>'seq')::INTEGER;
+
+        PERFORM 1 FROM sessions WHERE session_id = v_session_id FOR UPDATE;
+
+        IF NOT v_session_id = ANY(v_relocated) THEN
+            SELECT content INTO v_existing
+            FROM session_messages
+            WHERE session_id = v_session_id AND seq = v_seq;
+
+            IF FOUND AND v_existing = r->>'content' THEN
+                CONTINUE;
+            END IF;
+            IF FOUND THEN
+                v_relocated := array_append(v_relocated, v_session_id);
+            END IF;
+        END IF;
+
+        IF v_session_id = ANY(v_relocated) THEN
+            SELECT COALESCE(MAX(seq), -1) + 1 INTO v_seq
+            FROM session_messages
+            WHERE session_id = v_session_id;
+            v_moved := v_moved || jsonb_build_object(
+                'session_id', v_session_id,
+                'requested_seq', (r->>'seq')::INTEGER,
+                'seq', v_seq
+            );
+        END IF;
+
+        INSERT INTO session_messages (session_id, seq, content)
+        VALUES (v_session_id, v_seq, r->>'content');
+    END LOOP;
+
+    RETURN v_moved;
+END;
+$$ LANGUAGE plpgsql;
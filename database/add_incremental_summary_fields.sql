@@ -0,0 +1,11 @@
+-- Add incremental summary tracking to the sessions table
+-- Run this in your Supabase SQL editor
+-- While a session is active, summary/struggles/observations/tips hold a draft
+-- that covers the messages with seq below summary_upto_seq.
+
+ALTER TABLE sessions
+ADD COLUMN IF NOT EXISTS summary_upto_seq INTEGER DEFAULT 0;
+
+UPDATE sessions SET summary_upto_seq = 0 WHERE summary_upto_seq IS NULL;
+
+COMMENT ON COLUMN sessions.summary_upto_seq IS 'Messages with seq below this value are covered by the (draft) summary';
@@ -0,0 +1,12 @@
+-- Add rolling conversation memory fields to the sessions table
+-- Run this in your Supabase SQL editor
+
+ALTER TABLE sessions
+ADD COLUMN IF NOT EXISTS memory TEXT,
+ADD COLUMN IF NOT EXISTS memory_upto_seq INTEGER DEFAULT 0;
+
+-- Existing sessions start without a memory
+UPDATE sessions SET memory_upto_seq = 0 WHERE memory_upto_seq IS NULL;
+
+COMMENT ON COLUMN sessions.memory IS 'Compact AI-maintained summary of the older part of the conversation';
+COMMENT ON COLUMN sessions.memory_upto_seq IS 'Messages with seq below this value are covered by the memory';
@@ -0,0 +1,8 @@
+-- Indexes for keyset pagination of the session list
+-- Run this in your Supabase SQL editor
+-- GET /sessions pages on (created_at, id) newest first, optionally filtered by
+-- user or status, so each page is a single index range scan.
+
+CREATE INDEX IF NOT EXISTS idx_sessions_created_at_id ON sessions(created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_sessions_user_created_at_id ON sessions(user_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_sessions_status_created_at_id ON sessions(status, created_at DESC, id DESC);
@@ -0,0 +1,12 @@
+-- Add content hash for session summaries
+-- Run this in your Supabase SQL editor
+-- The backend stores a hash of the conversation + summary prompt version with each
+-- summary, so an unchanged conversation is never sent to the LLM again.
+
+ALTER TABLE sessions
+ADD COLUMN IF NOT EXISTS summary_hash VARCHAR(64);
+
+-- Create index for summary lookups by content hash
+CREATE INDEX IF NOT EXISTS idx_sessions_summary_hash ON sessions(summary_hash);
+
+COMMENT ON COLUMN sessions.summary_hash IS 'SHA-256 of the summarized conversation and summary prompt version';
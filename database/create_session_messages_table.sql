@@ -0,0 +1,67 @@
+-- Append-only message storage for conversation sessions
+-- Run this in your Supabase SQL editor
+-- Each turn inserts new rows keyed by (session_id, seq) instead of rewriting
+-- the whole sessions.conversation TEXT[] array.
+
+CREATE TABLE IF NOT EXISTS session_messages (
+    id BIGSERIAL PRIMARY KEY,
+    session_id VARCHAR(255) NOT NULL REFERENCES sessions(session_id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    UNIQUE (session_id, seq)
+);
+
+-- Number of messages stored for the session (next free seq)
+ALTER TABLE sessions
+ADD COLUMN IF NOT EXISTS message_count INTEGER DEFAULT 0;
+
+-- Step 1: Copy existing conversation arrays into session_messages
+-- (array positions are 1-based, seq is 0-based)
+INSERT INTO session_messages (session_id, seq, content, created_at)
+SELECT s.session_id, m.ord - 1, m.content, COALESCE(s.updated_at, s.created_at, NOW())
+FROM sessions s
+CROSS JOIN LATERAL unnest(s.conversation) WITH ORDINALITY AS m(content, ord)
+ON CONFLICT (session_id, seq) DO NOTHING;
+
+UPDATE sessions
+SET message_count = COALESCE(array_length(conversation, 1), 0);
+
+-- Step 2: The conversation column is no longer written by the backend.
+-- It is kept (not dropped) so the migration can be rolled back.
+ALTER TABLE sessions ALTER COLUMN conversation SET DEFAULT '{}';
+
+-- Step 3: Keep sessions.updated_at and message_count in sync with appended messages
+CREATE OR REPLACE FUNCTION touch_sessions_on_message_insert()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE sessions s
+    SET updated_at = NOW(),
+        message_count = GREATEST(COALESCE(s.message_count, 0), m.max_seq + 1)
+    FROM (
+        SELECT session_id, MAX(seq) AS max_seq
+        FROM new_messages
+        GROUP BY session_id
+    ) m
+    WHERE s.session_id = m.session_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_session_messages_touch_session ON session_messages;
+CREATE TRIGGER trg_session_messages_touch_session
+    AFTER INSERT ON session_messages
+    REFERENCING NEW TABLE AS new_messages
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION touch_sessions_on_message_insert();
+
+-- Enable Row Level Security (RLS)
+ALTER TABLE session_messages ENABLE ROW LEVEL SECURITY;
+
+-- Create policy for session_messages table (allow all operations for now)
+CREATE POLICY "Allow all operations on session_messages" ON session_messages
+    FOR ALL USING (true);
+
+COMMENT ON TABLE session_messages IS 'Append-only conversation messages, one row per message';
+COMMENT ON COLUMN session_messages.seq IS '0-based position of the message within its session';
+COMMENT ON COLUMN sessions.message_count IS 'Number of messages stored in session_messages for this session';
@@ -24,6 +24,92 @@ CREATE TABLE IF NOT EXISTS sessions (
     user_id INTEGER REFERENCES users(id) ON DELETE CASCADE
 );
 
+-- Step 3: Create append-only message table (one row per conversation message)
+CREATE TABLE IF NOT EXISTS session_messages (
+    id BIGSERIAL PRIMARY KEY,
+    session_id VARCHAR(255) NOT NULL REFERENCES sessions(session_id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    UNIQUE (session_id, seq)
+);
+
+ALTER TABLE sessions ADD COLUMN IF NOT EXISTS message_count INTEGER DEFAULT 0;
+ALTER TABLE sessions ALTER COLUMN conversation SET DEFAULT '{}';
+
+-- Keep sessions.updated_at and message_count in sync with appended messages
+CREATE OR REPLACE FUNCTION touch_sessions_on_message_insert()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE sessions s
+    SET updated_at = NOW(),
+        message_count = GREATEST(COALESCE(s.message_count, 0), m.max_seq + 1)
+    FROM (
+        SELECT session_id, MAX(seq) AS max_seq
+        FROM new_messages
+        GROUP BY session_id
+    ) m
+    WHERE s.session_id = m.session_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_session_messages_touch_session ON session_messages;
+CREATE TRIGGER trg_session_messages_touch_session
+    AFTER INSERT ON session_messages
+    REFERENCING NEW TABLE AS new_messages
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION touch_sessions_on_message_insert();
+
+-- Append messages with database-checked sequence numbers (see add_append_session_messages_function.sql)
+CREATE OR REPLACE FUNCTION append_session_messages(p_rows JSONB)
+RETURNS JSONB AS $$
+DECLARE
+    r JSONB;
+    v_session_id VARCHAR(255);
+    v_seq INTEGER;
+    v_existing TEXT;
+    v_relocated TEXT[] := '{}';
+    v_moved JSONB := '[]'::JSONB;
+BEGIN
+    FOR r IN SELECT value FROM jsonb_array_elements(p_rows) LOOP
+        v_session_id := r->>'session_id';
+        v_seq := (r->>'seq')::INTEGER;
+
+        PERFORM 1 FROM sessions WHERE session_id = v_session_id FOR UPDATE;
+
+        IF NOT v_session_id = ANY(v_relocated) THEN
+            SELECT content INTO v_existing
+            FROM session_messages
+            WHERE session_id = v_session_id AND seq = v_seq;
+
+            IF FOUND AND v_existing = r->>'content' THEN
+                CONTINUE;
+            END IF;
+            IF FOUND THEN
+                v_relocated := array_append(v_relocated, v_session_id);
+            END IF;
+        END IF;
+
+        IF v_session_id = ANY(v_relocated) THEN
+            SELECT COALESCE(MAX(seq), -1) + 1 INTO v_seq
+            FROM session_messages
+            WHERE session_id = v_session_id;
+            v_moved := v_moved || jsonb_build_object(
+                'session_id', v_session_id,
+                'requested_seq', (r->>'seq')::INTEGER,
+                'seq', v_seq
+            );
+        END IF;
+
+        INSERT INTO session_messages (session_id, seq, content)
+        VALUES (v_session_id, v_seq, r->>'content');
+    END LOOP;
+
+    RETURN v_moved;
+END;
+$$ LANGUAGE plpgsql;
+
 -- Create indexes for users table
 CREATE INDEX IF NOT EXISTS idx_users_username ON users(username);
 CREATE INDEX IF NOT EXISTS idx_users_email ON users(email);
@@ -33,6 +119,9 @@ CREATE INDEX IF NOT EXISTS idx_sessions_session_id ON sessions(session_id);
 CREATE INDEX IF NOT EXISTS idx_sessions_created_at ON sessions(created_at DESC);
 CREATE INDEX IF NOT EXISTS idx_sessions_user_id ON sessions(user_id);
 CREATE INDEX IF NOT EXISTS idx_sessions_status ON sessions(status);
+CREATE INDEX IF NOT EXISTS idx_sessions_created_at_id ON sessions(created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_sessions_user_created_at_id ON sessions(user_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_sessions_status_created_at_id ON sessions(status, created_at DESC, id DESC);
 
 -- Enable Row Level Security (RLS) for users
 ALTER TABLE users ENABLE ROW LEVEL SECURITY;
@@ -40,6 +129,9 @@ ALTER TABLE users ENABLE ROW LEVEL SECURITY;
 -- Enable Row Level Security (RLS) for sessions
 ALTER TABLE sessions ENABLE ROW LEVEL SECURITY;
 
+-- Enable Row Level Security (RLS) for session messages
+ALTER TABLE session_messages ENABLE ROW LEVEL SECURITY;
+
 -- Create policy for users table (allow all operations for now)
 CREATE POLICY "Allow user operations" ON users
     FOR ALL USING (true);
@@ -48,6 +140,10 @@ CREATE POLICY "Allow user operations" ON users
 CREATE POLICY "Allow all operations on sessions" ON sessions
     FOR ALL USING (true);
 
+-- Create policy for session_messages table (allow all operations for now)
+CREATE POLICY "Allow all operations on session_messages" ON session_messages
+    FOR ALL USING (true);
+
 -- Optional: If you want user-specific sessions later, you can use these policies instead:
 -- 
 -- DROP POLICY IF EXISTS "Allow all operations on sessions" ON sessions;